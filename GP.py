@@ -1,7 +1,12 @@
+import glob
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
 # ==============================
 # 1. PAGE CONFIG & ENHANCED STYLING
@@ -49,76 +54,145 @@ st.markdown("""
 # 2. DATA LOADING & CLEANING
 # ==============================
 FILE_PATH = r"BDA STREAMLIT.xlsx"
+# Bump when the cleaning steps change so an older sidecar is never reused
+CACHE_VERSION = 4
 
-@st.cache_data
-def load_and_clean_data():
+# Progressive slab thresholds and their payable %, in slab order
+SLAB_COLS = ['SLAB A', 'SLAB B', 'SLAB C', 'SLAB D', 'SLAB E']
+PCT_COLS = [
+    'SLAB A ACHIEVE PAYABLE AMOUNT%', 'SLAB B ACHIEVE PAYABLE AMOUNT%',
+    'SLAB C ACHIEVE PAYABLE AMOUNT%', 'SLAB D ACHIEVE PAYABLE AMOUNT%',
+    'SLAB E ACHIEVE PAYABLE AMOUNT%'
+]
+
+# Numeric columns the dashboard reads, plus the grouping keys; nothing else is parsed
+NUM_COLS = [
+    '2026 TOTEL PURCHASE', 'BASE TARGET', '2025 TOTEL PURCHASE', 'SALE OF 2025',
+    *SLAB_COLS, *PCT_COLS
+]
+USE_COLS = ['supplier', 'BRAND', 'CATEGORY', *NUM_COLS]
+
+# The Parquet sidecar is named after the workbook's (mtime_ns, size), so any
+# replaced workbook, even one with an older mtime, misses it and is re-read
+def sidecar_path(data_key):
+    mtime_ns, size = data_key
+    return f"{FILE_PATH}.v{CACHE_VERSION}.{mtime_ns}-{size}.parquet"
+
+# Cache entries are keyed on the workbook's (mtime_ns, size), so a replaced file
+# is reloaded and every cached view below recomputes against it
+@st.cache_data(show_spinner=False)
+def load_and_clean_data(data_key):
+    # No data_key means the workbook could not be stat'ed; skip the sidecar and
+    # let read_excel raise the error shown below
+    cache_path = sidecar_path(data_key) if data_key else None
     try:
-        df = pd.read_excel(FILE_PATH)
+        # Reuse the cleaned Parquet copy written for this exact workbook
+        if cache_path and os.path.exists(cache_path):
+            try:
+                return pd.read_parquet(cache_path)
+            except Exception:
+                pass  # Unreadable sidecar; rebuild it from the workbook below
+
+        # Headers carry stray whitespace (e.g. 'supplier '), so match on the stripped name
+        df = pd.read_excel(FILE_PATH, engine="calamine", usecols=lambda c: str(c).strip() in USE_COLS)
         df.columns = df.columns.str.strip()
         
         # Ensure critical columns are numeric for calculations
-        num_cols = [
-            '2026 TOTEL PURCHASE', 'BASE TARGET', '2025 TOTEL PURCHASE', 'SALE OF 2025',
-            'SLAB A', 'SLAB B', 'SLAB C', 'SLAB D', 'SLAB E',
-            'SLAB A ACHIEVE PAYABLE AMOUNT%', 'SLAB B ACHIEVE PAYABLE AMOUNT%',
-            'SLAB C ACHIEVE PAYABLE AMOUNT%', 'SLAB D ACHIEVE PAYABLE AMOUNT%',
-            'SLAB E ACHIEVE PAYABLE AMOUNT%'
-        ]
-        for col in num_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+        num_cols = [c for c in NUM_COLS if c in df.columns]
+        # Only columns that came back as text need parsing; numeric ones just get filled
+        text_cols = [c for c in num_cols if not pd.api.types.is_numeric_dtype(df[c])]
+        if text_cols:
+            df[text_cols] = df[text_cols].apply(pd.to_numeric, errors='coerce')
+        df[num_cols] = df[num_cols].fillna(0)
+
+        # Low-cardinality filter/group keys; compare and group on codes, not strings
+        for col in ("supplier", "BRAND", "CATEGORY"):
+            df[col] = df[col].astype("category")
+        # Sorted supplier index turns the per-rerun filter into a label lookup; the
+        # stable sort keeps each supplier's rows in sheet order (slabs read row 0)
+        df = df.set_index("supplier").sort_index(kind="stable")
+
+        # Write to a temp file and swap it in, so an interrupted write never leaves
+        # a truncated sidecar behind
+        try:
+            tmp_path = cache_path + ".tmp"
+            df.to_parquet(tmp_path, compression="zstd")
+            os.replace(tmp_path, cache_path)
+            # Drop sidecars left by earlier workbook revisions or cache versions
+            for old_path in glob.glob(glob.escape(FILE_PATH) + ".v*.parquet"):
+                if old_path != cache_path:
+                    os.remove(old_path)
+        except Exception:
+            pass  # Cache is best-effort; the workbook stays the source of truth
         return df
     except Exception as e:
         st.error(f"Error loading Excel: {e}")
         return pd.DataFrame()
 
-df = load_and_clean_data()
+try:
+    workbook_stat = os.stat(FILE_PATH)
+    data_key = (workbook_stat.st_mtime_ns, workbook_stat.st_size)
+except OSError:
+    data_key = None
+
+df = load_and_clean_data(data_key)
+if df.empty:
+    st.stop()  # The loader has already shown the error
+slab_pos = df.columns.get_indexer(SLAB_COLS)
+pct_pos = df.columns.get_indexer(PCT_COLS)
+# get_indexer marks missing columns with -1, which iat would read as the last column
+missing = [c for c, j in zip(SLAB_COLS + PCT_COLS, [*slab_pos, *pct_pos]) if j < 0]
+if missing:
+    raise KeyError(f"Missing slab columns in workbook: {missing}")
 
 # ==============================
 # 3. SIDEBAR NAVIGATION
 # ==============================
 st.sidebar.title("Supplier Filter")
-supplier_list = sorted(df["supplier"].unique().tolist())
-selected_supplier = st.sidebar.selectbox("Select Supplier Account", supplier_list)
 
-# Filter Dataset
-s_df = df[df["supplier"] == selected_supplier].copy()
+# Categories of the supplier index are already unique and sorted
+@st.cache_data
+def get_supplier_list(data_key):
+    return df.index.categories.tolist()
+
+supplier_list = get_supplier_list(data_key)
+selected_supplier = st.sidebar.selectbox("Select Supplier Account", supplier_list)
 
 # ==============================
 # 4. BUSINESS LOGIC & CALCULATIONS
 # ==============================
-p_2026 = s_df["2026 TOTEL PURCHASE"].sum()
-p_2025 = s_df["2025 TOTEL PURCHASE"].sum()
-s_2025 = s_df["SALE OF 2025"].sum()
-b_target = s_df["BASE TARGET"].sum()
-
-# Identify Active Slabs (Ignore zeros)
-row = s_df.iloc[0]
-slabs_ref = [
-    ('SLAB A', 'SLAB A ACHIEVE PAYABLE AMOUNT%'),
-    ('SLAB B', 'SLAB B ACHIEVE PAYABLE AMOUNT%'),
-    ('SLAB C', 'SLAB C ACHIEVE PAYABLE AMOUNT%'),
-    ('SLAB D', 'SLAB D ACHIEVE PAYABLE AMOUNT%'),
-    ('SLAB E', 'SLAB E ACHIEVE PAYABLE AMOUNT%')
-]
+# Cached per supplier so reruns that keep the selection skip the aggregation
+@st.cache_data
+def compute_supplier_summary(data_key, supplier):
+    s_df = df.loc[[supplier]]
+    # One reduction over the KPI column block instead of four Series sums
+    p_2026, p_2025, s_2025, b_target = s_df[
+        ["2026 TOTEL PURCHASE", "2025 TOTEL PURCHASE", "SALE OF 2025", "BASE TARGET"]
+    ].to_numpy().sum(axis=0)
 
-active_slabs = []
-current_earned_pct = 0
-
-for s_col, p_col in slabs_ref:
-    t_val = row[s_col]
-    if t_val > 0:
-        gap = max(0, t_val - p_2026)
-        is_achieved = p_2026 >= t_val
-        active_slabs.append({
-            "Name": s_col,
-            "Target": t_val,
-            "Gap": gap,
-            "Percent": row[p_col],
-            "Status": is_achieved
-        })
-        if is_achieved:
-            current_earned_pct = row[p_col]
+    # Identify Active Slabs (Ignore zeros); scalar reads avoid boxing a row Series
+    thresholds = np.array([s_df.iat[0, j] for j in slab_pos], dtype=float)
+    # Payable % keep each column's own scalar type so they display as in the sheet (3%, 1.5%)
+    pcts = np.array([s_df.iat[0, j] for j in pct_pos], dtype=object)
+    active = thresholds > 0
+    achieved = active & (p_2026 >= thresholds)
+
+    # Progressive slabs: the last achieved slab sets the earned rebate %
+    current_earned_pct = 0
+    if achieved.any():
+        last_idx = len(achieved) - 1 - achieved[::-1].argmax()
+        current_earned_pct = pcts[last_idx]
+
+    slab_df = pd.DataFrame({
+        "Name": SLAB_COLS,
+        "Target": thresholds,
+        "Gap": np.maximum(0, thresholds - p_2026),
+        "Percent": pcts,
+        "Status": achieved
+    })[active]
+    return p_2026, p_2025, s_2025, b_target, current_earned_pct, slab_df
+
+p_2026, p_2025, s_2025, b_target, current_earned_pct, slab_df = compute_supplier_summary(data_key, selected_supplier)
 
 est_rebate_val = p_2026 * (current_earned_pct / 100)
 
@@ -154,18 +228,18 @@ with col_perf:
         }
     ))
     fig_gauge.update_layout(height=350)
-    st.plotly_chart(fig_gauge, use_container_width=True)
+    st.plotly_chart(fig_gauge, use_container_width=True, key="base_target_gauge")
 
 with col_comp:
     st.subheader("📊 Purchase vs Sales (History)")
-    comp_data = pd.DataFrame({
-        'Category': ['2025 Sales', '2025 Purchase', 'Base Target', '2026 Purchase'],
-        'Amount': [s_2025, p_2025, b_target, p_2026]
-    })
-    fig_comp = px.bar(comp_data, x='Category', y='Amount', color='Category', 
-                     text_auto='.3s', color_discrete_sequence=px.colors.qualitative.Bold)
+    fig_comp = go.Figure(go.Bar(
+        x=['2025 Sales', '2025 Purchase', 'Base Target', '2026 Purchase'],
+        y=[s_2025, p_2025, b_target, p_2026],
+        marker_color=px.colors.qualitative.Bold[:4],
+        texttemplate='%{y:.3s}'
+    ))
     fig_comp.update_layout(showlegend=False, height=350)
-    st.plotly_chart(fig_comp, use_container_width=True)
+    st.plotly_chart(fig_comp, use_container_width=True, key="history_comparison")
 
 # ==============================
 # 7. VERTICAL SLAB PROGRESS (LEFT TO RIGHT)
@@ -173,41 +247,40 @@ with col_comp:
 st.divider()
 st.subheader("🪜 Individual Slab Progress (Vertical View)")
 
-if active_slabs:
-    # Dynamically create vertical columns for each slab
-    slab_cols = st.columns(len(active_slabs))
-    
-    for i, s in enumerate(active_slabs):
-        with slab_cols[i]:
-            # Each Slab gets its own separate vertical graph
-            fig_s = go.Figure()
-            
-            # Grey background bar representing the full target
-            fig_s.add_trace(go.Bar(
-                x=[s['Name']], y=[s['Target']],
-                marker_color='#e5e7eb', hoverinfo='skip', showlegend=False
-            ))
-            
-            # Progress bar showing actual purchase
-            progress = min(p_2026, s['Target'])
-            fig_s.add_trace(go.Bar(
-                x=[s['Name']], y=[progress],
-                marker_color='#10b981' if s['Status'] else '#3b82f6',
-                text=f"{(progress/s['Target']*100):.1f}%",
-                textposition='inside', showlegend=False
-            ))
-            
-            fig_s.update_layout(
-                barmode='overlay', height=450,
-                title=f"<b>{s['Name']}</b><br>{s['Percent']}% Rebate",
-                title_x=0.5,
-                yaxis=dict(range=[0, s['Target'] * 1.1], gridcolor='#f3f4f6')
-            )
-            st.plotly_chart(fig_s, use_container_width=True)
-            
-            # Detail labels below each vertical graph
-            if s['Gap'] > 0:
-                st.error(f"📌 Need: **{s['Gap']:,.0f}**")
+if not slab_df.empty:
+    slab_rows = list(slab_df.itertuples(index=False))
+
+    # One figure with a vertical subplot per slab, shipped as a single chart
+    fig_slabs = make_subplots(
+        rows=1, cols=len(slab_rows),
+        subplot_titles=[f"<b>{s.Name}</b><br>{s.Percent}% Rebate" for s in slab_rows]
+    )
+
+    for i, s in enumerate(slab_rows, start=1):
+        # Grey background bar representing the full target
+        fig_slabs.add_trace(go.Bar(
+            x=[s.Name], y=[s.Target],
+            marker_color='#e5e7eb', hoverinfo='skip', showlegend=False
+        ), row=1, col=i)
+        
+        # Progress bar showing actual purchase
+        progress = min(p_2026, s.Target)
+        fig_slabs.add_trace(go.Bar(
+            x=[s.Name], y=[progress],
+            marker_color='#10b981' if s.Status else '#3b82f6',
+            text=f"{(progress/s.Target*100):.1f}%",
+            textposition='inside', showlegend=False
+        ), row=1, col=i)
+        fig_slabs.update_yaxes(range=[0, s.Target * 1.1], gridcolor='#f3f4f6', row=1, col=i)
+
+    fig_slabs.update_layout(barmode='overlay', height=450, margin=dict(t=80))
+    st.plotly_chart(fig_slabs, use_container_width=True, key="slab_progress")
+
+    # Detail labels below each slab
+    for slab_col, s in zip(st.columns(len(slab_rows)), slab_rows):
+        with slab_col:
+            if s.Gap > 0:
+                st.error(f"📌 Need: **{s.Gap:,.0f}**")
             else:
                 st.success("✅ Slab Achieved!")
 else:
@@ -216,24 +289,57 @@ else:
 # ==============================
 # 8. PRODUCT BREAKDOWN (BRAND & CATEGORY)
 # ==============================
+# Brands beyond this many are bucketed into a single "Other" pie slice
+MAX_BRAND_SLICES = 15
+
+# Cached per supplier so revisiting a selection skips the groupbys, the raw slice
+# and its CSV export
+@st.cache_data
+def compute_product_breakdown(data_key, supplier):
+    s_df = df.loc[[supplier]]
+    brands = s_df.groupby("BRAND", observed=True, sort=False)["2026 TOTEL PURCHASE"].sum()
+    top = brands.nlargest(MAX_BRAND_SLICES)
+    brand_df = pd.DataFrame({"BRAND": top.index.astype(str), "2026 TOTEL PURCHASE": top.to_numpy()})
+    if len(brands) > MAX_BRAND_SLICES:
+        brand_df.loc[len(brand_df)] = ["Other", brands.sum() - top.sum()]
+    cat_df = s_df.groupby("CATEGORY", observed=True)["2026 TOTEL PURCHASE"].sum().reset_index()
+    raw_df = s_df[['BRAND', 'CATEGORY', '2026 TOTEL PURCHASE', 'BASE TARGET']]
+    raw_csv = raw_df.to_csv(index=False).encode()
+    return brand_df, cat_df, raw_df, raw_csv
+
+brand_df, cat_df, raw_df, raw_csv = compute_product_breakdown(data_key, selected_supplier)
+
 st.divider()
 st.subheader("📋 Detailed Product Summary")
-b_left, b_right = st.columns(2)
 
-with b_left:
-    brand_df = s_df.groupby("BRAND")["2026 TOTEL PURCHASE"].sum().reset_index()
-    fig_p = px.pie(brand_df, names='BRAND', values='2026 TOTEL PURCHASE', 
-                   hole=0.5, title="Purchase Share by Brand")
-    st.plotly_chart(fig_p, use_container_width=True)
+# Brand share and category volume side by side in a single figure
+fig_products = make_subplots(
+    rows=1, cols=2, specs=[[{"type": "domain"}, {"type": "xy"}]],
+    subplot_titles=["Purchase Share by Brand", "Volume by Category"]
+)
+fig_products.add_trace(go.Pie(
+    labels=brand_df['BRAND'], values=brand_df['2026 TOTEL PURCHASE'], hole=0.5
+), row=1, col=1)
+
+palette = px.colors.qualitative.Plotly
+fig_products.add_trace(go.Bar(
+    x=cat_df['CATEGORY'].astype(str), y=cat_df['2026 TOTEL PURCHASE'],
+    marker_color=[palette[i % len(palette)] for i in range(len(cat_df))],
+    showlegend=False
+), row=1, col=2)
+fig_products.update_layout(height=450)
+st.plotly_chart(fig_products, use_container_width=True, key="product_breakdown")
 
-with b_right:
-    cat_df = s_df.groupby("CATEGORY")["2026 TOTEL PURCHASE"].sum().reset_index()
-    fig_c = px.bar(cat_df, x='CATEGORY', y='2026 TOTEL PURCHASE', 
-                   title="Volume by Category", color='CATEGORY')
-    st.plotly_chart(fig_c, use_container_width=True)
+# Footer Detail (capped preview; the full slice is available as CSV)
+RAW_PREVIEW_ROWS = 500
 
-# Footer Detail
 with st.expander("📂 View Raw Transaction Data"):
-    st.dataframe(s_df[['BRAND', 'CATEGORY', '2026 TOTEL PURCHASE', 'BASE TARGET']], use_container_width=True)
+    st.dataframe(raw_df.head(RAW_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+    if len(raw_df) > RAW_PREVIEW_ROWS:
+        st.caption(f"Showing the first {RAW_PREVIEW_ROWS:,} of {len(raw_df):,} rows.")
+    st.download_button(
+        "Download full CSV", raw_csv,
+        file_name=f"{selected_supplier}.csv", mime="text/csv"
+    )
 
 st.sidebar.success("Dashboard Fully Loaded!")